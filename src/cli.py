@@ -5,15 +5,25 @@ import os
 from pathlib import Path
 
 # 相対インポート
-from ollama_client import pull_model, lint_with_llm
+from ollama_client import CircuitBreaker, check_health, lint_with_llm, pull_model, warm_up
 from rules import lint_with_rules
 
+def _line_label(item: dict) -> str:
+    """AIの指摘に行番号があれば表示用の文字列を返す"""
+    line = item.get("line")
+    return f" (行 {line})" if isinstance(line, int) else ""
+
+
 def print_analysis(advice: dict, source: str = "LLM") -> None:
     """解析結果を表示する"""
     
     title = f" 🔍 解析レポート ({source}) "
     print("\n" + title.center(60, "="))
 
+    checked = advice.get("checked_lines")
+    if checked:
+        print(f"(解析範囲: 行 {checked[0]}-{checked[1]})")
+
     # --- ルールベースの結果 ---
     rule_issues = advice.get("rule_based_issues", [])
     if rule_issues:
@@ -32,7 +42,7 @@ def print_analysis(advice: dict, source: str = "LLM") -> None:
         for t in terms:
             surface = t.get("surface", "???")
             note = t.get("note", "")
-            print(f" • {surface:<20} | {note}")
+            print(f" • {surface:<20} | {note}{_line_label(t)}")
 
     # 表記揺れ
     inconsistencies = advice.get("inconsistencies", [])
@@ -43,7 +53,7 @@ def print_analysis(advice: dict, source: str = "LLM") -> None:
             b = i.get("b", "?")
             note = i.get("note", "")
             itype = i.get("type", "style")
-            print(f" • {a} <-> {b} ({itype})\n   └─ {note}")
+            print(f" • {a} <-> {b} ({itype}){_line_label(i)}\n   └─ {note}")
 
     # 提案
     suggestions = advice.get("suggestions", [])
@@ -55,7 +65,22 @@ def print_analysis(advice: dict, source: str = "LLM") -> None:
     print("\n" + "="*60 + "\n")
 
 
-def process_file(file_path: Path, use_llm: bool) -> None:
+def prepare_llm() -> bool:
+    """Ollamaの状態を事前確認し、必要ならモデルをロードしておく"""
+    try:
+        loaded = check_health()
+        if not loaded:
+            print(f"モデルをロード中: {os.getenv('OLLAMA_MODEL', 'gemma2:2b')} ...")
+            warm_up()
+    except Exception as e:
+        print(f"LLMエラー: {e}")
+        print("  -> AIチェックを無効化してルールチェックのみ実行します。")
+        print()
+        return False
+    return True
+
+
+def process_file(file_path: Path, use_llm: bool, breaker: CircuitBreaker | None = None) -> None:
     """単一ファイルの処理"""
     print(f"チェック中: {file_path}")
     
@@ -70,14 +95,21 @@ def process_file(file_path: Path, use_llm: bool) -> None:
     print_analysis(rule_result, source="ルール")
 
     # 2. LLM (オプション)
-    if use_llm:
+    if use_llm and breaker is not None and breaker.is_open:
+        print("  -> LLMエラーが続いたため、AIチェックはスキップされました。")
+        print()
+    elif use_llm:
         print("LLMの応答を待機中...")
         try:
-            advice = lint_with_llm(text[:1500])
+            advice = lint_with_llm(text)
             print_analysis(advice, source="AI (Ollama)")
+            if breaker is not None:
+                breaker.record_success()
         except Exception as e:
             print(f"LLMエラー: {e}")
             print("(Ollamaが起動しているか、モデルがpullされているか確認してください)")
+            if breaker is not None:
+                breaker.record_failure()
     else:
         print("  -> AIチェックはスキップされました。 --llm で有効化できます。")
         print()
@@ -89,6 +121,7 @@ def main(argv: list[str] | None = None) -> None:
     p.add_argument("--llm", action="store_true", help="OllamaによるAIアドバイスを有効化")
     p.add_argument("--pull-model", action="store_true", help="Ollamaモデルをpullして終了")
     p.add_argument("--gui", action="store_true", help="GUIモードで起動")
+    p.add_argument("--lsp", action="store_true", help="Language Server（標準入出力）として起動")
     args = p.parse_args(argv)
 
     if args.pull_model:
@@ -101,6 +134,10 @@ def main(argv: list[str] | None = None) -> None:
         gui_main()
         return
 
+    if args.lsp:
+        from lsp import main as lsp_main
+        raise SystemExit(lsp_main(use_llm=args.llm))
+
     if not args.path:
         p.print_help()
         raise SystemExit(1)
@@ -110,6 +147,9 @@ def main(argv: list[str] | None = None) -> None:
     if not target_path.exists():
         raise SystemExit(f"パスが見つかりません: {target_path}")
 
+    use_llm = args.llm and prepare_llm()
+    breaker = CircuitBreaker() if use_llm else None
+
     if target_path.is_dir():
         md_files = list(target_path.glob("*.md"))
         if not md_files:
@@ -118,10 +158,10 @@ def main(argv: list[str] | None = None) -> None:
             
         print(f"{target_path} 内に {len(md_files)} 個のMarkdownファイルが見つかりました\n")
         for md_file in md_files:
-            process_file(md_file, args.llm)
+            process_file(md_file, use_llm, breaker)
             
     elif target_path.is_file():
-        process_file(target_path, args.llm)
+        process_file(target_path, use_llm, breaker)
         
     else:
         print(f"エラー: {target_path} は有効なファイルまたはディレクトリではありません")
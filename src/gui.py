@@ -1,10 +1,11 @@
 from __future__ import annotations
 
 import sys
+import time
 from pathlib import Path
 from typing import Any
 
-from PySide6.QtCore import Qt, QTimer, Signal
+from PySide6.QtCore import QObject, Qt, QThread, QTimer, Signal, Slot
 from PySide6.QtGui import QAction, QColor, QFont, QTextCursor
 from PySide6.QtWidgets import (
     QApplication,
@@ -35,12 +36,18 @@ class EditorPane(QPlainTextEdit):
     
     textChangedDelayed = Signal()
     
+    # デバウンス間隔の範囲（ms）
+    MIN_DEBOUNCE_MS = 150
+    MAX_DEBOUNCE_MS = 2000
+    
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setFont(QFont("Monospace", 10))
         self.setTabStopDistance(40)
         
-        # デバウンスタイマー（500ms）
+        # デバウンスタイマー（初期値500ms、描画時間に応じて調整）
+        self.debounce_interval = 500
+        self._render_time_avg: float | None = None
         self.debounce_timer = QTimer()
         self.debounce_timer.setSingleShot(True)
         self.debounce_timer.timeout.connect(self.textChangedDelayed.emit)
@@ -50,7 +57,19 @@ class EditorPane(QPlainTextEdit):
     def _on_text_changed(self):
         """テキスト変更時にデバウンスタイマーを再起動"""
         self.debounce_timer.stop()
-        self.debounce_timer.start(500)
+        self.debounce_timer.start(self.debounce_interval)
+    
+    def report_render_time(self, elapsed_ms: float):
+        """計測した描画時間からデバウンス間隔を調整"""
+        # 指数移動平均で外れ値の影響を抑える
+        if self._render_time_avg is None:
+            self._render_time_avg = elapsed_ms
+        else:
+            self._render_time_avg = 0.7 * self._render_time_avg + 0.3 * elapsed_ms
+        
+        # 描画時間の約2倍を待つ（入力中に描画が追いつかないのを防ぐ）
+        interval = int(self._render_time_avg * 2)
+        self.debounce_interval = max(self.MIN_DEBOUNCE_MS, min(self.MAX_DEBOUNCE_MS, interval))
     
     def highlight_line(self, line_number: int):
         """指定行をハイライト表示して移動"""
@@ -59,6 +78,60 @@ class EditorPane(QPlainTextEdit):
         self.centerCursor()
 
 
+def _mermaid_formatter(source, language, css_class, options, md, **kwargs):
+    """Mermaidブロック用のカスタムフォーマッター"""
+    return f'<div class="mermaid">\n{source}\n</div>'
+
+
+def create_markdown() -> markdown.Markdown:
+    """プレビュー用のMarkdownコンバータを生成（Mermaid対応）"""
+    return markdown.Markdown(
+        extensions=[
+            'fenced_code',
+            'tables',
+            'codehilite',
+            'pymdownx.superfences',
+        ],
+        extension_configs={
+            'pymdownx.superfences': {
+                'custom_fences': [
+                    {
+                        'name': 'mermaid',
+                        'class': 'mermaid',
+                        'format': _mermaid_formatter
+                    }
+                ]
+            }
+        }
+    )
+
+
+class RenderWorker(QObject):
+    """バックグラウンドスレッドでMarkdownをHTMLに変換するワーカー"""
+    
+    rendered = Signal(int, str, float)  # revision, html, elapsed_ms
+    
+    def __init__(self):
+        super().__init__()
+        self._md: markdown.Markdown | None = None
+    
+    @Slot(int, str)
+    def render(self, revision: int, text: str):
+        """指定リビジョンのテキストを変換して結果を通知"""
+        # コンバータはワーカースレッド内で生成し、使い回す
+        if self._md is None:
+            self._md = create_markdown()
+        
+        start = time.perf_counter()
+        try:
+            html = self._md.reset().convert(text)
+        except Exception as e:
+            html = f"<p style='color: #E85D75;'>プレビューエラー: {e}</p>"
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        
+        self.rendered.emit(revision, html, elapsed_ms)
+
+
 class PreviewPane(QWebEngineView):
     """Markdownプレビュー用のWebビュー"""
     
@@ -66,39 +139,11 @@ class PreviewPane(QWebEngineView):
         super().__init__(parent)
         self.setHtml(self._get_empty_html())
     
-    def update_preview(self, markdown_text: str):
-        """Markdownテキストをレンダリング"""
-        html_content = self._markdown_to_html(markdown_text)
+    def show_html(self, html_content: str):
+        """変換済みのHTMLを表示"""
         full_html = self._wrap_html(html_content)
         self.setHtml(full_html)
     
-    def _markdown_to_html(self, text: str) -> str:
-        """MarkdownをHTMLに変換（Mermaid対応）"""
-        md = markdown.Markdown(
-            extensions=[
-                'fenced_code',
-                'tables',
-                'codehilite',
-                'pymdownx.superfences',
-            ],
-            extension_configs={
-                'pymdownx.superfences': {
-                    'custom_fences': [
-                        {
-                            'name': 'mermaid',
-                            'class': 'mermaid',
-                            'format': self._mermaid_formatter
-                        }
-                    ]
-                }
-            }
-        )
-        return md.convert(text)
-    
-    def _mermaid_formatter(self, source, language, css_class, options, md, **kwargs):
-        """Mermaidブロック用のカスタムフォーマッター"""
-        return f'<div class="mermaid">\n{source}\n</div>'
-    
     def _wrap_html(self, content: str) -> str:
         """HTMLテンプレートでラップ"""
         return f"""
@@ -229,10 +274,19 @@ class IssuesPane(QListWidget):
 class MDCheckGUI(QMainWindow):
     """メインウィンドウ"""
     
+    renderRequested = Signal(int, str)
+    
     def __init__(self):
         super().__init__()
         self.current_file: Path | None = None
+        
+        # プレビュー描画の状態（最新リビジョンのみ描画し、古い結果は破棄）
+        self._render_revision = 0
+        self._render_busy = False
+        self._pending_render: tuple[int, str] | None = None
+        
         self.setup_ui()
+        self.setup_render_worker()
         self.create_menus()
         self.setWindowTitle("MDCheck - Markdown Checker with Preview")
         self.resize(1400, 800)
@@ -271,6 +325,18 @@ class MDCheckGUI(QMainWindow):
         # ステータスバー
         self.statusBar().showMessage("準備完了")
     
+    def setup_render_worker(self):
+        """プレビュー描画用のワーカースレッドを起動"""
+        self.render_thread = QThread(self)
+        self.render_worker = RenderWorker()
+        self.render_worker.moveToThread(self.render_thread)
+        self.render_thread.finished.connect(self.render_worker.deleteLater)
+        
+        self.renderRequested.connect(self.render_worker.render)
+        self.render_worker.rendered.connect(self._on_preview_rendered)
+        
+        self.render_thread.start()
+    
     def create_menus(self):
         """メニューバーの作成"""
         menubar = self.menuBar()
@@ -370,9 +436,40 @@ class MDCheckGUI(QMainWindow):
             self.statusBar().showMessage(f"保存エラー: {e}")
     
     def _on_editor_changed(self):
-        """エディタ変更時にプレビューを更新"""
-        text = self.editor.toPlainText()
-        self.preview.update_preview(text)
+        """エディタ変更時にプレビューの描画を依頼"""
+        self._render_revision += 1
+        request = (self._render_revision, self.editor.toPlainText())
+        
+        if self._render_busy:
+            # 描画中は最新の依頼だけを保持し、途中のリビジョンは捨てる
+            self._pending_render = request
+        else:
+            self._dispatch_render(request)
+    
+    def _dispatch_render(self, request: tuple[int, str]):
+        """ワーカーに描画を依頼"""
+        self._render_busy = True
+        self.renderRequested.emit(*request)
+    
+    def _on_preview_rendered(self, revision: int, html: str, elapsed_ms: float):
+        """ワーカーの描画完了時にプレビューを更新"""
+        self._render_busy = False
+        self.editor.report_render_time(elapsed_ms)
+        
+        # 最新リビジョンの結果のみ反映
+        if revision == self._render_revision:
+            self.preview.show_html(html)
+        
+        if self._pending_render is not None:
+            request = self._pending_render
+            self._pending_render = None
+            self._dispatch_render(request)
+    
+    def closeEvent(self, event):
+        """終了時にワーカースレッドを停止"""
+        self.render_thread.quit()
+        self.render_thread.wait()
+        super().closeEvent(event)
     
     def run_rules_check(self):
         """ルールベースのチェックを実行"""
@@ -403,15 +500,17 @@ class MDCheckGUI(QMainWindow):
         text = self.editor.toPlainText()
         
         try:
-            # 長いテキストは先頭1500文字に制限
-            result = lint_with_llm(text[:1500])
+            # コード等を除いた本文を、トークン上限に収まる範囲で解析
+            result = lint_with_llm(text)
             
             # 用語・固有名詞
             terms = result.get("terms", [])
             for t in terms:
                 surface = t.get("surface", "???")
                 note = t.get("note", "")
-                self.issues.add_issue(f"[用語] {surface}: {note}", None, "ai")
+                line = t.get("line")
+                line_number = line if isinstance(line, int) else None
+                self.issues.add_issue(f"[用語] {surface}: {note}", line_number, "ai")
             
             # 表記揺れ
             inconsistencies = result.get("inconsistencies", [])
@@ -419,7 +518,9 @@ class MDCheckGUI(QMainWindow):
                 a = i.get("a", "?")
                 b = i.get("b", "?")
                 note = i.get("note", "")
-                self.issues.add_issue(f"[表記揺れ] {a} <-> {b}: {note}", None, "ai")
+                line = i.get("line")
+                line_number = line if isinstance(line, int) else None
+                self.issues.add_issue(f"[表記揺れ] {a} <-> {b}: {note}", line_number, "ai")
             
             # 提案
             suggestions = result.get("suggestions", [])
@@ -427,7 +528,9 @@ class MDCheckGUI(QMainWindow):
                 self.issues.add_issue(f"[提案] {s}", None, "ai")
             
             total = len(terms) + len(inconsistencies) + len(suggestions)
-            self.statusBar().showMessage(f"AIチェック完了: {total}件の指摘")
+            checked = result.get("checked_lines")
+            scope = f"（行 {checked[0]}-{checked[1]} を解析）" if checked else ""
+            self.statusBar().showMessage(f"AIチェック完了: {total}件の指摘{scope}")
             
         except Exception as e:
             self.issues.add_issue(f"❌ AIチェックエラー: {e}", None, "ai")
@@ -0,0 +1,412 @@
+from __future__ import annotations
+
+import json
+import re
+import sys
+import threading
+from typing import Any, BinaryIO, Dict
+
+from ollama_client import CircuitBreaker, lint_with_llm
+from rules import lint_lines, split_lines
+
+# LSPの定数
+SEVERITY_WARNING = 2
+SEVERITY_INFORMATION = 3
+TEXT_DOCUMENT_SYNC_INCREMENTAL = 2
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+# 最後の変更からAIチェックを開始するまでの待ち時間（秒）
+LLM_DELAY_SECONDS = 2.0
+
+# AIチェックが連続で失敗した後、再試行するまでの待ち時間（秒）
+LLM_RETRY_SECONDS = 60.0
+
+_LINE_PREFIX = re.compile(r"^行\s*\d+:\s*")
+
+
+def _utf16_to_index(line: str, character: int) -> int:
+    """UTF-16単位の文字位置をPythonの文字列インデックスに変換"""
+    units = 0
+    for index, ch in enumerate(line):
+        if units >= character:
+            return index
+        units += 2 if ord(ch) > 0xFFFF else 1
+    return len(line)
+
+
+def _utf16_len(text: str) -> int:
+    """UTF-16単位での文字列長"""
+    return sum(2 if ord(ch) > 0xFFFF else 1 for ch in text)
+
+
+def _check_line(line: str) -> list[str]:
+    """1行分のルールチェック結果（行番号の接頭辞は除去）"""
+    # ルールは "\n" 終わりを前提にしているので、CRLF/CRの行末を揃える
+    if line.endswith("\r\n") or line.endswith("\r"):
+        line = line.rstrip("\r\n") + "\n"
+    return [_LINE_PREFIX.sub("", issue) for issue in lint_lines([line])]
+
+
+class Document:
+    """エディタで開かれているMarkdown文書（行単位でチェック結果を保持）"""
+
+    def __init__(self, text: str, version: int = 0):
+        self.version = version
+        self.lines: list[str] = []
+        self.line_issues: list[list[str]] = []
+        self.set_text(text)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.lines)
+
+    def set_text(self, text: str) -> None:
+        """全文を置き換えて再チェック"""
+        self.lines = split_lines(text)
+        self.line_issues = [_check_line(line) for line in self.lines]
+
+    def apply_change(self, change: Dict[str, Any]) -> None:
+        """didChangeの変更を1件適用し、変更された行だけ再チェック"""
+        if "range" not in change:
+            self.set_text(change["text"])
+            return
+
+        start = change["range"]["start"]
+        end = change["range"]["end"]
+        start_line, end_line = start["line"], end["line"]
+
+        # 最終行の次（空行）を指す位置も許容する
+        first = self.lines[start_line] if start_line < len(self.lines) else ""
+        last = self.lines[end_line] if end_line < len(self.lines) else ""
+
+        segment = (
+            first[:_utf16_to_index(first, start["character"])]
+            + change["text"]
+            + last[_utf16_to_index(last, end["character"]):]
+        )
+        new_lines = split_lines(segment)
+
+        self.lines[start_line:end_line + 1] = new_lines
+        self.line_issues[start_line:end_line + 1] = [_check_line(line) for line in new_lines]
+
+    def diagnostics(self) -> list[Dict[str, Any]]:
+        """ルールチェック結果をLSPのDiagnosticに変換"""
+        result = []
+        for i, issues in enumerate(self.line_issues):
+            if not issues:
+                continue
+            width = _utf16_len(self.lines[i].rstrip("\r\n"))
+            for message in issues:
+                result.append({
+                    "range": {
+                        "start": {"line": i, "character": 0},
+                        "end": {"line": i, "character": width},
+                    },
+                    "severity": SEVERITY_WARNING,
+                    "source": "mdcheck",
+                    "message": message,
+                })
+        return result
+
+
+def _llm_line(item: Any, advice: Dict[str, Any]) -> int:
+    """AIの指摘の行番号（0始まり）。不明な場合は解析範囲の先頭行にする"""
+    checked = advice.get("checked_lines") or [1, 1]
+    line = item.get("line") if isinstance(item, dict) else None
+    if isinstance(line, int) and checked[0] <= line <= checked[1]:
+        return line - 1
+    return checked[0] - 1
+
+
+def _llm_diagnostics(advice: Dict[str, Any]) -> list[Dict[str, Any]]:
+    """AIの解析結果をLSPのDiagnosticに変換"""
+    findings = []
+    for t in advice.get("terms", []):
+        findings.append((t, f"[用語] {t.get('surface', '???')}: {t.get('note', '')}"))
+    for i in advice.get("inconsistencies", []):
+        findings.append((i, f"[表記揺れ] {i.get('a', '?')} <-> {i.get('b', '?')}: {i.get('note', '')}"))
+    for s in advice.get("suggestions", []):
+        findings.append((s, f"[提案] {s}"))
+
+    result = []
+    for item, message in findings:
+        line = _llm_line(item, advice)
+        result.append({
+            "range": {
+                "start": {"line": line, "character": 0},
+                "end": {"line": line, "character": 0},
+            },
+            "severity": SEVERITY_INFORMATION,
+            "source": "mdcheck (AI)",
+            "message": message,
+        })
+    return result
+
+
+def _llm_disabled_notice() -> list[Dict[str, Any]]:
+    """AIチェック停止中であることを示すDiagnostic"""
+    return _llm_diagnostics({
+        "suggestions": [
+            f"AIチェックはエラーが続いたため停止中です（{int(LLM_RETRY_SECONDS)}秒後の編集で再試行します）"
+        ]
+    })
+
+
+class LanguageServer:
+    """標準入出力で動作するmdcheckのLanguage Server"""
+
+    def __init__(self, reader: BinaryIO, writer: BinaryIO, use_llm: bool = False):
+        self.reader = reader
+        self.writer = writer
+        self.use_llm = use_llm
+        self.documents: Dict[str, Document] = {}
+        self.llm_results: Dict[str, list[Dict[str, Any]]] = {}
+        self._llm_timers: Dict[str, threading.Timer] = {}
+        self._llm_running: set[str] = set()
+        self._llm_breaker = CircuitBreaker(cooldown=LLM_RETRY_SECONDS)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._shutdown = False
+
+    # --- JSON-RPC ---
+
+    def _read_message(self) -> Dict[str, Any] | None:
+        """Content-Lengthヘッダ付きのメッセージを1件読み込む"""
+        length = None
+        while True:
+            line = self.reader.readline()
+            if not line:
+                return None
+            line = line.strip()
+            if not line:
+                break
+            name, _, value = line.decode("ascii", errors="replace").partition(":")
+            if name.lower() == "content-length":
+                try:
+                    length = int(value.strip())
+                except ValueError:
+                    # 本文の長さが分からないと以降の区切りを復元できない
+                    print(f"mdcheck lsp: 不正なContent-Lengthです: {value.strip()!r}", file=sys.stderr)
+                    return None
+
+        if length is None:
+            return None
+        message = json.loads(self.reader.read(length).decode("utf-8"))
+        if not isinstance(message, dict):
+            raise ValueError(f"JSON-RPCのメッセージではありません: {message!r}")
+        return message
+
+    def _send(self, message: Dict[str, Any]) -> None:
+        body = json.dumps({"jsonrpc": "2.0", **message}, ensure_ascii=False).encode("utf-8")
+        with self._write_lock:
+            self.writer.write(f"Content-Length: {len(body)}\r\n\r\n".encode("ascii"))
+            self.writer.write(body)
+            self.writer.flush()
+
+    def _respond(self, request_id: Any, result: Any) -> None:
+        self._send({"id": request_id, "result": result})
+
+    def _send_error(self, request_id: Any, code: int, message: str) -> None:
+        self._send({"id": request_id, "error": {"code": code, "message": message}})
+
+    def _notify(self, method: str, params: Dict[str, Any]) -> None:
+        self._send({"method": method, "params": params})
+
+    def serve(self) -> int:
+        """exit通知を受けるまでメッセージを処理し、終了コードを返す"""
+        while True:
+            try:
+                message = self._read_message()
+            except ValueError as e:
+                print(f"mdcheck lsp: 不正なメッセージを無視しました: {e!r}", file=sys.stderr)
+                continue
+            if message is None:
+                return 1
+
+            method = message.get("method")
+            if method == "exit":
+                return 0 if self._shutdown else 1
+
+            handler = getattr(self, "_on_" + (method or "").replace("/", "_").replace("$", "_"), None)
+            if "id" in message:
+                if handler is None:
+                    self._send_error(message["id"], METHOD_NOT_FOUND, f"Method not found: {method}")
+                    continue
+                try:
+                    result = handler(message.get("params") or {})
+                except (KeyError, TypeError, ValueError) as e:
+                    self._send_error(message["id"], INVALID_PARAMS, f"Invalid params for {method}: {e!r}")
+                except Exception as e:
+                    self._send_error(message["id"], INTERNAL_ERROR, f"{method}: {e!r}")
+                else:
+                    self._respond(message["id"], result)
+            elif handler is not None:
+                # 通知には応答できないので、エラーはstderrに出して処理を続ける
+                try:
+                    handler(message.get("params") or {})
+                except Exception as e:
+                    print(f"mdcheck lsp: {method} の処理に失敗しました: {e!r}", file=sys.stderr)
+
+    # --- ライフサイクル ---
+
+    def _on_initialize(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "capabilities": {
+                "textDocumentSync": {
+                    "openClose": True,
+                    "change": TEXT_DOCUMENT_SYNC_INCREMENTAL,
+                    "save": True,
+                },
+            },
+            "serverInfo": {"name": "mdcheck"},
+        }
+
+    def _on_initialized(self, params: Dict[str, Any]) -> None:
+        pass
+
+    def _on_shutdown(self, params: Dict[str, Any]) -> None:
+        self._shutdown = True
+        with self._lock:
+            for timer in self._llm_timers.values():
+                timer.cancel()
+            self._llm_timers.clear()
+        return None
+
+    # --- 文書の同期 ---
+
+    def _on_textDocument_didOpen(self, params: Dict[str, Any]) -> None:
+        item = params["textDocument"]
+        uri = item["uri"]
+        with self._lock:
+            self.documents[uri] = Document(item["text"], item.get("version", 0))
+        self._schedule_llm(uri)
+        self._publish(uri)
+
+    def _on_textDocument_didChange(self, params: Dict[str, Any]) -> None:
+        uri = params["textDocument"]["uri"]
+        with self._lock:
+            doc = self.documents.get(uri)
+            if doc is None:
+                return
+            for change in params["contentChanges"]:
+                doc.apply_change(change)
+            doc.version = params["textDocument"].get("version", doc.version + 1)
+        self._schedule_llm(uri)
+        self._publish(uri)
+
+    def _on_textDocument_didSave(self, params: Dict[str, Any]) -> None:
+        pass
+
+    def _on_textDocument_didClose(self, params: Dict[str, Any]) -> None:
+        uri = params["textDocument"]["uri"]
+        with self._lock:
+            self.documents.pop(uri, None)
+            self.llm_results.pop(uri, None)
+            timer = self._llm_timers.pop(uri, None)
+            if timer is not None:
+                timer.cancel()
+        self._notify("textDocument/publishDiagnostics", {"uri": uri, "diagnostics": []})
+
+    def _publish(self, uri: str) -> None:
+        """ルールとAIの結果をまとめて通知"""
+        with self._lock:
+            doc = self.documents.get(uri)
+            if doc is None:
+                return
+            diagnostics = doc.diagnostics() + self.llm_results.get(uri, [])
+            version = doc.version
+        self._notify("textDocument/publishDiagnostics", {
+            "uri": uri,
+            "version": version,
+            "diagnostics": diagnostics,
+        })
+
+    # --- AIチェック（バックグラウンド） ---
+
+    def _schedule_llm(self, uri: str) -> None:
+        """入力が落ち着いてからAIチェックを実行（新しいリビジョンが来たら取り消す）"""
+        if not self.use_llm:
+            return
+        if self._llm_breaker.is_open:
+            with self._lock:
+                self.llm_results[uri] = _llm_disabled_notice()
+            return
+        with self._lock:
+            timer = self._llm_timers.pop(uri, None)
+            if timer is not None:
+                timer.cancel()
+            timer = threading.Timer(LLM_DELAY_SECONDS, self._run_llm, args=(uri,))
+            timer.daemon = True
+            self._llm_timers[uri] = timer
+        timer.start()
+
+    def _run_llm(self, uri: str) -> None:
+        """AIチェックを実行（文書ごとに同時に1件まで、実行中の更新は終了後にまとめて処理）"""
+        with self._lock:
+            # 発火したタイマーを待機中の一覧から外す
+            if self._llm_timers.get(uri) is threading.current_thread():
+                del self._llm_timers[uri]
+            # 実行中なら、終了時にバージョンを見て再実行してもらう
+            if uri in self._llm_running:
+                return
+            self._llm_running.add(uri)
+
+        try:
+            while self._run_llm_once(uri):
+                pass
+        except Exception:
+            with self._lock:
+                self._llm_running.discard(uri)
+            raise
+
+    def _run_llm_once(self, uri: str) -> bool:
+        """最新の内容でAIチェックを1回実行し、続けて再実行が必要かを返す"""
+        with self._lock:
+            doc = self.documents.get(uri)
+            if doc is None:
+                self._llm_running.discard(uri)
+                return False
+            version = doc.version
+            text = doc.text
+
+        if not self._llm_breaker.allow_request():
+            diagnostics = _llm_disabled_notice()
+        else:
+            try:
+                diagnostics = _llm_diagnostics(lint_with_llm(text))
+                self._llm_breaker.record_success()
+            except Exception as e:
+                self._llm_breaker.record_failure()
+                if self._llm_breaker.is_open:
+                    diagnostics = _llm_disabled_notice()
+                else:
+                    diagnostics = _llm_diagnostics({"suggestions": [f"AIチェックエラー: {e}"]})
+
+        with self._lock:
+            doc = self.documents.get(uri)
+            if doc is not None and doc.version == version:
+                self.llm_results[uri] = diagnostics
+            # 実行中に更新され、かつ待機中のタイマーがなければ最新の内容で再実行
+            rerun = (
+                doc is not None
+                and doc.version != version
+                and uri not in self._llm_timers
+                and not self._llm_breaker.is_open
+            )
+            if not rerun:
+                self._llm_running.discard(uri)
+
+        if doc is not None and doc.version == version:
+            self._publish(uri)
+        return rerun
+
+def main(use_llm: bool = False) -> int:
+    """Language Serverのエントリーポイント"""
+    server = LanguageServer(sys.stdin.buffer, sys.stdout.buffer, use_llm=use_llm)
+    return server.serve()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(use_llm="--llm" in sys.argv[1:]))
@@ -3,9 +3,13 @@ from __future__ import annotations
 import os
 import requests
 import json
-from typing import Any, Dict
+import threading
+import time
+from typing import Any, Callable, Dict
 from dotenv import load_dotenv
 
+from preprocess import estimate_tokens, fit_to_budget, minimize_markdown
+
 # .envファイルを読み込む
 load_dotenv()
 
@@ -17,26 +21,152 @@ def _model() -> str:
     return os.getenv("OLLAMA_MODEL", "gemma2:2b")
 
 
-def pull_model(model: str | None = None) -> None:
+def _keep_alive() -> str:
+    return os.getenv("OLLAMA_KEEP_ALIVE", "10m")
+
+
+def _prompt_tokens() -> int:
+    return int(os.getenv("OLLAMA_PROMPT_TOKENS", "1500"))
+
+
+# ヘルスチェック用の短いタイムアウト（秒）
+PROBE_TIMEOUT = 3
+
+
+def _model_names(models: list[Dict[str, Any]]) -> set[str]:
+    """/api/tags, /api/ps のモデル一覧から名前の集合を作る（":latest" は省略形も含める）"""
+    names = set()
+    for m in models:
+        name = m.get("name") or m.get("model") or ""
+        names.add(name)
+        if name.endswith(":latest"):
+            names.add(name[: -len(":latest")])
+    return names
+
+
+def check_health(model: str | None = None) -> bool:
     """
-    Ollama側にモデルをpullさせる
+    Ollamaの起動とモデルの有無を確認する。
+    問題があればValueErrorを送出し、モデルがロード済みかどうかを返す。
+    """
+    m = model or _model()
+    try:
+        r = requests.get(f"{_host()}/api/tags", timeout=PROBE_TIMEOUT)
+    except requests.RequestException as e:
+        raise ValueError(f"Ollamaに接続できません ({_host()}): {e}") from e
+    if r.status_code != 200:
+        raise ValueError(f"Ollama API Error ({r.status_code}): {r.text}")
+
+    if m not in _model_names(r.json().get("models", [])):
+        raise ValueError(f"モデルがpullされていません: {m} (mdcheck --pull-model で取得できます)")
+
+    # ロード状況の確認は補助的なものなので、失敗しても致命的にはしない
+    try:
+        r = requests.get(f"{_host()}/api/ps", timeout=PROBE_TIMEOUT)
+    except requests.RequestException:
+        return False
+    if r.status_code != 200:
+        return False
+    return m in _model_names(r.json().get("models", []))
+
+
+def warm_up(model: str | None = None) -> None:
+    """
+    モデルを事前にロードしておく（プロンプトなしのgenerateはロードのみ行う）
+    """
+    m = model or _model()
+    r = requests.post(
+        f"{_host()}/api/generate",
+        json={"model": m, "keep_alive": _keep_alive()},
+        timeout=120,
+    )
+    if r.status_code != 200:
+        raise ValueError(f"Failed to load model: {r.text}")
+
+
+class CircuitBreaker:
+    """
+    LLM呼び出しが連続して失敗したら、以降の呼び出しを止めるためのブレーカー
+    cooldownを指定すると、その秒数が経過した後に1回だけ再試行を許可する（half-open）
+    """
+
+    def __init__(self, max_failures: int = 3, cooldown: float | None = None):
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        if self.failures < self.max_failures:
+            return False
+        if self.cooldown is None:
+            return True
+        return time.monotonic() - self.opened_at < self.cooldown
+
+    def allow_request(self) -> bool:
+        """呼び出してよいか判定する（half-open中は最初の1回だけ許可）"""
+        with self._lock:
+            if self.is_open:
+                return False
+            if self.failures >= self.max_failures:
+                # 再試行中は他の呼び出しを止めておく
+                self.opened_at = time.monotonic()
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.max_failures:
+                self.opened_at = time.monotonic()
+
+
+def _print_progress(status: str, completed: int | None, total: int | None) -> None:
+    if completed is not None and total:
+        # ダウンロード中は同じ行を上書きし、完了したら改行する
+        percent = completed * 100 // total
+        end = "\n" if completed >= total else ""
+        print(f"\r  {status}: {percent:3d}% ({completed // 2**20}/{total // 2**20} MB)", end=end, flush=True)
+    else:
+        print(f"  {status}")
+
+
+def pull_model(
+    model: str | None = None,
+    on_progress: Callable[[str, int | None, int | None], None] | None = _print_progress,
+) -> None:
+    """
+    Ollama側にモデルをpullさせる（進行状況は on_progress(status, completed, total) で通知）
     """
     m = model or _model()
     # モデルの有無確認は省略し、常にpullリクエストを投げる（既ににあれば高速に終わる）
     print(f"Pulling model: {m} ...")
     r = requests.post(f"{_host()}/api/pull", json={"name": m}, stream=True, timeout=600)
-    # stream=Trueにしているので、レスポンスを待つ
-    for line in r.iter_lines():
-        if line:
-            # 進行状況が見たい場合はここでデコードしてprintしても良い
-            pass
     if r.status_code != 200:
         raise ValueError(f"Failed to pull model: {r.text}")
 
+    # stream=Trueなので、1行ずつJSONで進行状況が届く
+    for line in r.iter_lines():
+        if not line:
+            continue
+        event = json.loads(line)
+        if "error" in event:
+            raise ValueError(f"Failed to pull model: {event['error']}")
+        if on_progress is not None:
+            on_progress(event.get("status", ""), event.get("completed"), event.get("total"))
+
 
 def lint_with_llm(markdown_text: str) -> Dict[str, Any]:
     """
     Markdown文の「表記揺れ/固有名詞揺れ/曖昧表現」を“候補”として列挙する。
+    コード・URL・表などを短縮した本文に元の行番号を付け、プロンプト全体が
+    トークン上限に収まる範囲だけ送る。指摘には元の行番号 "line" が付き、
+    解析した元の行範囲は "checked_lines" ([開始行, 終了行]) として返す。
     """
     # プロンプトを日本語出力指示付きに変更
     system = (
@@ -44,25 +174,39 @@ def lint_with_llm(markdown_text: str) -> Dict[str, Any]:
         "Return ONLY valid JSON. No prose.\n"
         "Do NOT rewrite the text. Only list candidates and hints.\n"
         "IMPORTANT: The values for 'note' and 'suggestions' MUST be in **Japanese**.\n"
+        "Each input line starts with its line number (e.g. 'L12: '). "
+        "Set 'line' to the number of the line the finding refers to.\n"
         "JSON schema:\n"
         "{\n"
-        '  "terms": [{"surface":"...", "note":"(Japanese explanation)"}],\n'
-        '  "inconsistencies": [{"type":"proper_noun|style|term", "a":"...", "b":"...", "note":"(Japanese explanation)"}],\n'
+        '  "terms": [{"surface":"...", "line":12, "note":"(Japanese explanation)"}],\n'
+        '  "inconsistencies": [{"type":"proper_noun|style|term", "a":"...", "b":"...", "line":12, "note":"(Japanese explanation)"}],\n'
         '  "suggestions": ["(Japanese suggestion)..."]\n'
         "}\n"
     )
 
-    user = (
+    user_template = (
         "Analyze the following Markdown and list:\n"
         "- proper nouns / product names / acronyms candidates\n"
         "- possible spelling inconsistencies\n"
         "- short suggestions (max 5)\n\n"
+        "Code blocks are replaced with [code] and URLs with [URL]. Ignore them.\n\n"
         "Markdown:\n"
         "-----\n"
-        f"{markdown_text}\n"
+        "{prose}\n"
         "-----\n"
     )
 
+    # 固定部分のトークン数を差し引いた残りを本文に割り当てる
+    budget = _prompt_tokens() - estimate_tokens(system + user_template.format(prose=""))
+    if budget <= 0:
+        raise ValueError(f"OLLAMA_PROMPT_TOKENS が小さすぎます: {_prompt_tokens()}")
+
+    numbered = [(n, f"L{n}: {line}") for n, line in minimize_markdown(markdown_text)]
+    lines = fit_to_budget(numbered, budget)
+    if not lines:
+        return {}
+    user = user_template.format(prose="\n".join(line for _, line in lines))
+
     payload = {
         "model": _model(),
         "messages": [
@@ -71,6 +215,7 @@ def lint_with_llm(markdown_text: str) -> Dict[str, Any]:
         ],
         "stream": False,
         "format": "json",
+        "keep_alive": _keep_alive(),
         "options": {
             "temperature": 0.1 # 安定性を高めるため少し下げる
         }
@@ -84,7 +229,12 @@ def lint_with_llm(markdown_text: str) -> Dict[str, Any]:
     content = data["message"]["content"]
     
     try:
-        return json.loads(content)
+        advice = json.loads(content)
     except json.JSONDecodeError:
-        # 万が一JSON以外が返ってきた場合のフォールバック（簡易）
-        return {"suggestions": ["JSON解析エラー: LLMの応答が不正でした"]}
\ No newline at end of file
+        advice = None
+    if not isinstance(advice, dict):
+        # 万が一JSONオブジェクト以外が返ってきた場合のフォールバック（簡易）
+        advice = {"suggestions": ["JSON解析エラー: LLMの応答が不正でした"]}
+
+    advice["checked_lines"] = [lines[0][0], lines[-1][0]]
+    return advice
\ No newline at end of file
@@ -0,0 +1,104 @@
+import re
+
+from rules import split_lines
+
+# LLMに送る前にMarkdownから取り除く/短縮する要素
+FENCE_RE = re.compile(r"^\s*(`{3,}|~{3,})")
+REF_DEF_RE = re.compile(r"^\s*\[[^\]]+\]:\s*\S+")
+TABLE_SEP_RE = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)+\|?\s*$")
+HR_RE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+IMAGE_RE = re.compile(r"!\[([^\]]*)\]\([^)]*\)")
+LINK_RE = re.compile(r"\[([^\]]+)\]\([^)]*\)")
+REF_LINK_RE = re.compile(r"!?\[([^\]]+)\]\[[^\]]*\]")
+AUTOLINK_RE = re.compile(r"<https?://[^>]+>")
+URL_RE = re.compile(r"https?://[^\s)>\]]+")
+HTML_COMMENT_RE = re.compile(r"<!--.*?-->")
+HTML_TAG_RE = re.compile(r"</?[A-Za-z][^>]*>")
+
+CODE_PLACEHOLDER = "[code]"
+URL_PLACEHOLDER = "[URL]"
+
+
+def _shorten_inline(line: str) -> str:
+    """画像・リンク・URL・HTMLタグを短縮"""
+    line = IMAGE_RE.sub(r"\1", line)
+    line = LINK_RE.sub(r"\1", line)
+    line = REF_LINK_RE.sub(r"\1", line)
+    line = AUTOLINK_RE.sub(URL_PLACEHOLDER, line)
+    line = URL_RE.sub(URL_PLACEHOLDER, line)
+    line = HTML_TAG_RE.sub("", line)
+    return line
+
+
+def minimize_markdown(text: str) -> list[tuple[int, str]]:
+    """
+    Markdownから文章以外の要素を取り除き、(元の行番号, 短縮後の行) のリストを返す
+    """
+    result = []
+    fence = None
+    in_comment = False
+
+    for i, line in enumerate(split_lines(text), 1):
+        line = line.rstrip("\r\n")
+        # コードブロック（開始行のみプレースホルダーに置き換える）
+        if fence is not None:
+            stripped = line.strip()
+            if stripped.startswith(fence) and not stripped.strip(fence[0]):
+                fence = None
+            continue
+        match = FENCE_RE.match(line)
+        if match:
+            fence = match.group(1)
+            result.append((i, CODE_PLACEHOLDER))
+            continue
+
+        # HTMLコメント（複数行にまたがる場合も含む）
+        if in_comment:
+            if "-->" not in line:
+                continue
+            line = line.split("-->", 1)[1]
+            in_comment = False
+        line = HTML_COMMENT_RE.sub("", line)
+        if "<!--" in line:
+            line = line.split("<!--", 1)[0]
+            in_comment = True
+
+        if REF_DEF_RE.match(line) or TABLE_SEP_RE.match(line) or HR_RE.match(line):
+            continue
+
+        # 表の行はセルの文字だけ残す
+        if line.lstrip().startswith("|"):
+            cells = [c.strip() for c in line.strip().strip("|").split("|")]
+            line = " / ".join(c for c in cells if c)
+
+        # 記号だけの行（引用の ">" のみなど）は送らない
+        line = " ".join(_shorten_inline(line).split())
+        if any(ch.isalnum() for ch in line):
+            result.append((i, line))
+
+    return result
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数の概算（日本語などの全角文字は1文字1トークン、それ以外は4文字1トークン）
+    """
+    wide = sum(1 for ch in text if ord(ch) >= 0x3000)
+    narrow = len(text) - wide
+    return wide + (narrow + 3) // 4
+
+
+def fit_to_budget(lines: list[tuple[int, str]], budget: int) -> list[tuple[int, str]]:
+    """先頭から、トークン数の概算がbudgetに収まる分だけの行を返す"""
+    result = []
+    total = 0
+    for line_no, line in lines:
+        tokens = estimate_tokens(line) + 1  # 改行分
+        if total + tokens > budget:
+            if not result:
+                # 1行目だけで上限を超える場合は切り詰めて送る
+                result.append((line_no, line[:budget]))
+            break
+        result.append((line_no, line))
+        total += tokens
+    return result
@@ -1,9 +1,23 @@
 import re
 
-def check_header_spacing(lines: list[str]) -> list[str]:
+# LSPと同じく \r\n, \r, \n のみを改行として扱う（str.splitlinesは\u2028なども分割する）
+_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+def split_lines(text: str) -> list[str]:
+    """改行文字を残したまま行に分割"""
+    lines = []
+    pos = 0
+    for match in _LINE_BREAK.finditer(text):
+        lines.append(text[pos:match.end()])
+        pos = match.end()
+    if pos < len(text):
+        lines.append(text[pos:])
+    return lines
+
+def check_header_spacing(lines: list[str], start: int = 1) -> list[str]:
     """見出し(#)の後に適切な空白があるかチェック"""
     issues = []
-    for i, line in enumerate(lines, 1):
+    for i, line in enumerate(lines, start):
         stripped = line.lstrip()
         if stripped.startswith('#'):
             match = re.match(r"^(#+)(.*)", stripped)
@@ -19,28 +33,33 @@ def check_header_spacing(lines: list[str]) -> list[str]:
                     
     return issues
 
-def check_trailing_whitespace(lines: list[str]) -> list[str]:
+def check_trailing_whitespace(lines: list[str], start: int = 1) -> list[str]:
     """行末の不要な空白をチェック"""
     issues = []
-    for i, line in enumerate(lines, 1):
+    for i, line in enumerate(lines, start):
         if line.endswith(" \n") or line.endswith("\t\n"):
             issues.append(f"行 {i}: 行末に余計な空白があります")
     return issues
 
-def check_todos(lines: list[str]) -> list[str]:
+def check_todos(lines: list[str], start: int = 1) -> list[str]:
     """残っているTODOコメントをチェック"""
     issues = []
-    for i, line in enumerate(lines, 1):
+    for i, line in enumerate(lines, start):
         if "TODO" in line or "FIXME" in line:
             issues.append(f"行 {i}: TODO/FIXMEが見つかりました -> {line.strip()}")
     return issues
 
-def lint_with_rules(text: str) -> dict:
-    lines = text.splitlines(keepends=True)
+def lint_lines(lines: list[str], start: int = 1) -> list[str]:
+    """行単位のルールをまとめて実行（startは先頭行の行番号）"""
     suggestions = []
-    suggestions.extend(check_header_spacing(lines))
-    suggestions.extend(check_trailing_whitespace(lines))
-    suggestions.extend(check_todos(lines))
+    suggestions.extend(check_header_spacing(lines, start))
+    suggestions.extend(check_trailing_whitespace(lines, start))
+    suggestions.extend(check_todos(lines, start))
+    return suggestions
+
+def lint_with_rules(text: str) -> dict:
+    lines = split_lines(text)
+    suggestions = lint_lines(lines)
 
     return {
         "rule_based_issues": suggestions